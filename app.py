@@ -1,49 +1,162 @@
+import contextlib
 import datetime
-import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+import geopandas as gpd
+import lonboard
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import requests
 import streamlit as st
+import streamlit.components.v1 as components
 
 # set the base URL for the API
 url = "https://deprem.afad.gov.tr/apiv2/event/filter?"
 
-# create a function to get earthquake data for a given date range
-@st.cache_data
-def get_earthquake_data(start_date, end_date):
+# bounding box around Türkiye, used to filter events on the API side
+TURKEY_BBOX = {
+    "minlat": 35.8,
+    "maxlat": 42.1,
+    "minlon": 25.6,
+    "maxlon": 44.8
+}
+
+# maximum number of API requests sent in parallel
+MAX_WORKERS = 8
+
+# directory holding the per-month parquet cache
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+# how long after a month ends it keeps being refetched, since AFAD still
+# adds late events and revises existing ones (see isEventUpdate/lastUpdateDate)
+CACHE_GRACE_PERIOD = datetime.timedelta(days=7)
+
+# timeout in seconds for a single API request
+REQUEST_TIMEOUT = 30
+
+# maximum number of events drawn on the map
+MAX_MAP_POINTS = 20000
+
+# first date available in the dashboard
+AFAD_EPOCH = datetime.datetime(2023, 1, 1)
+
+# how often the cached history is refreshed with new events
+REFRESH_TTL = datetime.timedelta(minutes=10)
+
+# number of selections kept by the caches of per-selection outputs
+MAX_CACHE_ENTRIES = 8
+
+# create a single HTTP session shared across reruns, keeping connections alive
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+# split a date range into the calendar months (start, end) covering it
+def month_chunks(start_date, end_date):
+    first_month = start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_starts = pd.date_range(first_month, end_date, freq="MS")
+    return [(d.to_pydatetime(), (d + pd.offsets.MonthBegin(1)).to_pydatetime()) for d in month_starts]
+
+# get the earthquake data for a single date chunk
+def fetch_chunk(session, start_date, end_date):
     # format the dates in the required format
     start_date_str = start_date.strftime("%Y-%m-%d %H:%M:%S")
     end_date_str = end_date.strftime("%Y-%m-%d %H:%M:%S")
     # set the API parameters
     params = {
         "start": start_date_str,
-        "end": end_date_str
+        "end": end_date_str,
+        **TURKEY_BBOX
     }
     # send the request to the API
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
-    
-    # convert the response content into JSON format
-    data = response.json()
-    
-    # convert the response content to a pandas dataframe
-    df_r = pd.read_json(json.dumps(data))
-    
-    # filter data for Turkey
+
+    # convert the JSON response directly to a pandas dataframe
+    return pd.DataFrame(response.json())
+
+# get a calendar month of earthquake data, served from the disk cache when possible
+def fetch_month(session, start_date, end_date):
+    path = os.path.join(CACHE_DIR, f"afad_{start_date:%Y%m}.parquet")
+    # months that are not over yet, or ended only recently, may still change
+    complete = end_date <= datetime.datetime.now() - CACHE_GRACE_PERIOD
+    if complete and os.path.exists(path):
+        try:
+            return pd.read_parquet(path)
+        except Exception:
+            # unreadable cache file, drop it and fetch the month again
+            with contextlib.suppress(OSError):
+                os.remove(path)
+    df = fetch_chunk(session, start_date, end_date)
+    if complete:
+        write_cache(df, path)
+    return df
+
+# store a month in the disk cache; caching is best-effort, a failed write
+# only means the month is fetched again next time
+def write_cache(df, path):
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # write to a temporary file first so an interrupted write never leaves
+        # a truncated file at the cache path
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".parquet.tmp")
+        os.close(fd)
+        df.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+    except Exception:
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+# create a function to get earthquake data for a given date range
+def get_earthquake_data(start_date, end_date):
+    # fetch the months concurrently over the shared session
+    session = get_session()
+    chunks = month_chunks(start_date, end_date)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        frames = list(ex.map(lambda chunk: fetch_month(session, *chunk), chunks))
+    # adjacent chunks share their boundary timestamp, so drop repeated events
+    df_r = pd.concat(frames, ignore_index=True).drop_duplicates(subset="eventID")
+
+    # the bounding box also covers border regions of neighbouring countries,
+    # so keep only the events attributed to Turkey
     df = df_r[df_r['country'] == ('Türkiye')].copy()
     
     # extract the date and time columns
     df["date"] = pd.to_datetime(df["date"])
+    # whole months were fetched, trim them to the requested date range
+    df = df[df["date"].between(start_date, end_date)].copy()
     df["date_s"] = df["date"].dt.date
     df["GMT_time"] = df["date"].dt.time
     df["IST_time"] = (df["date"] + pd.Timedelta(hours=3)).dt.time
-    df = df.set_index("date")
+    df = df.set_index("date").sort_index()
     
-    # convert latitude and longitude columns to numeric
-    df["latitude"] = pd.to_numeric(df["latitude"])
-    df["longitude"] = pd.to_numeric(df["longitude"])
-    return df
+    # convert the coordinate, magnitude and depth columns to float32
+    for col in ("latitude", "longitude", "magnitude", "depth"):
+        df[col] = pd.to_numeric(df[col], errors="coerce", downcast="float")
+    df.dropna(subset=["latitude", "longitude", "magnitude"], inplace=True)
+
+    # store the low-cardinality text columns as categories
+    for col in ("location", "type", "province", "district", "neighborhood", "country"):
+        if col in df:
+            df[col] = df[col].astype("category")
+
+    # precompute the daily maximum magnitude for the unfiltered data
+    daily_max = df.groupby(df.index.normalize())["magnitude"].max()
+    return df, daily_max
+
+# load the whole history once; date selections are sliced from it in memory
+@st.cache_data(ttl=REFRESH_TTL)
+def load_full_history():
+    loaded_at = datetime.datetime.now()
+    df, daily_max = get_earthquake_data(AFAD_EPOCH, loaded_at)
+    # the load time identifies this version of the history in downstream cache keys
+    return df, daily_max, loaded_at
 
 # set the default date range to start on Feb-6
 end_date = datetime.datetime.now()
@@ -56,6 +169,8 @@ st.title("Türkiye Earthquakes Dashboard")
 # create a sidebar slider for date
 date_range = st.sidebar.slider(
     "Select a date range",
+    min_value=AFAD_EPOCH.date(),
+    max_value=end_date.date(),
     value=(start_date.date(), end_date.date()),
     format="MM/DD/YYYY",
     key="date_slider"
@@ -64,31 +179,35 @@ date_range = st.sidebar.slider(
 # get the earthquake data for the selected date range
 start_date_sel = datetime.datetime.combine(date_range[0], datetime.time.min)
 end_date_sel = datetime.datetime.combine(date_range[1], datetime.time.max)
-df = get_earthquake_data(start_date_sel, end_date_sel)
-
-# export the dataframe to a CSV file
-df.to_csv("earthquake_data.csv", index=False)
+full_df, full_daily_max, loaded_at = load_full_history()
+df = full_df.loc[start_date_sel:end_date_sel]
+daily_max = full_daily_max.loc[start_date_sel:end_date_sel]
 
 # create a sidebar slider for magnitude
 magnitude_range = st.sidebar.slider('Select a magnitude range', 0.0, 8.0, (0.0,8.0), step=0.1)
 
 # filter the dataframe based on the selected magnitude range
-df_filtered = df[(df['magnitude'].astype(float) >= magnitude_range[0]) & (df['magnitude'].astype(float) <= magnitude_range[1])]
+# (bounds are cast to float32 so magnitudes equal to a bound are kept)
+mag_min, mag_max = np.float32(magnitude_range[0]), np.float32(magnitude_range[1])
+df_filtered = df[(df['magnitude'] >= mag_min) & (df['magnitude'] <= mag_max)]
+
+# key for the caches of per-selection outputs: the filter state plus the
+# version of the history the selection was sliced from
+selection_key = (date_range, magnitude_range, loaded_at)
 
 # display the total count of earthquakes in the filtered dataframe
 st.sidebar.metric("Total Earthquakes Count", len(df_filtered))
 
 
 # compute time differences between earthquakes
-df_filtered = df_filtered.sort_values("date_s")
-df_filtered["time_diff"] = df_filtered["date_s"].diff().apply(lambda x: x.total_seconds() / 60)
-df_filtered = df_filtered.dropna(subset=["time_diff"])
-time_diff_avg = df_filtered.groupby(df_filtered["date_s"])["time_diff"].mean() # group by date and compute average time difference
-df["time_diff"] = df["date_s"].diff().apply(lambda x: x.total_seconds() / 60)
+intervals = df_filtered.index.to_series().diff().dt.total_seconds().div(60)
+time_diff_avg = intervals.groupby(df_filtered.index.floor("D")).mean() # group by date and compute average time difference
+df_intervals = df.index.to_series().diff().dt.total_seconds().div(60)
 
 
-df_last_24_hours = df[df.index >= datetime.datetime.now() - datetime.timedelta(hours=24)]
-time_between_last_24_hours = df_last_24_hours["time_diff"]
+last_24_hours = df.index >= datetime.datetime.now() - datetime.timedelta(hours=24)
+df_last_24_hours = df[last_24_hours]
+time_between_last_24_hours = df_intervals[last_24_hours]
 if not time_between_last_24_hours.empty and time_between_last_24_hours.notna().all():
     avg_time_between_last_24_hours = round(time_between_last_24_hours.mean())
     minutes, seconds = divmod(avg_time_between_last_24_hours, 60)
@@ -100,26 +219,64 @@ if not time_between_last_24_hours.empty and time_between_last_24_hours.notna().a
 else:
     st.sidebar.warning("No data available for the selected filters.")
 
-# scatter mapbox plot of earthquake locations
-df_filtered["magnitude_num"] = pd.to_numeric(df_filtered["magnitude"]) # convert magnitude to numeric
-df_sorted = df_filtered.sort_values("magnitude_num", ascending=True) # sort dataframe by magnitude
+# scatter plot layer of earthquake locations, shipped to the browser as GeoArrow
+# cache the map build per selection; the frame itself is not hashed, it is
+# identified by the selection key
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES)
+def build_map_html(_df_filtered, selection_key):
+    # keep only the columns the map uses
+    plot_df = _df_filtered[["latitude", "longitude", "magnitude", "location"]]
+    # for very large selections, draw only the strongest events
+    if len(plot_df) > MAX_MAP_POINTS:
+        plot_df = plot_df.nlargest(MAX_MAP_POINTS, "magnitude")
+    df_sorted = plot_df.sort_values("magnitude", ascending=True) # sort dataframe by magnitude
+    # the categories span the whole history, ship only the locations drawn
+    properties = df_sorted[["magnitude", "location"]].reset_index(drop=True)
+    properties["location"] = properties["location"].cat.remove_unused_categories()
+    gdf = gpd.GeoDataFrame(
+        properties,
+        geometry=gpd.points_from_xy(df_sorted["longitude"], df_sorted["latitude"]),
+        crs="EPSG:4326"
+    )
+    magnitude = df_sorted["magnitude"].to_numpy()
+    fill_color = np.column_stack([
+        np.full(len(magnitude), 255),
+        np.clip(140 - magnitude * 15, 0, 255),
+        np.zeros(len(magnitude)),
+        np.full(len(magnitude), 180)
+    ]).astype(np.uint8)
+    layer = lonboard.ScatterplotLayer.from_geopandas(
+        gdf,
+        get_radius=magnitude * 1000,
+        get_fill_color=fill_color,
+        pickable=True
+    )
+    return lonboard.Map(layer).to_html()
+
 st.subheader("Earthquake Locations with Magnitude Map")
-fig = px.scatter_mapbox(df_sorted, lat="latitude", lon="longitude", color="magnitude_num", size="magnitude_num",
-hover_name="location", opacity = 0.7,
-color_continuous_scale=px.colors.sequential.Burgyl, size_max=10, zoom=5)
-fig.update_layout(mapbox_style="open-street-map")
-st.plotly_chart(fig)
+if df_filtered.empty:
+    st.info("No earthquakes to show on the map for the selected filters.")
+else:
+    map_html = build_map_html(df_filtered, selection_key)
+    components.html(map_html, height=600)
 
 # line chart of earthquake magnitudes over time
 st.subheader("Magnitude Over Time (average)")
-df_filtered['magnitude'] = pd.to_numeric(df_filtered['magnitude'], errors='coerce')
-df_filtered.dropna(subset=['magnitude'], inplace=True)
-mag_over_time = df_filtered["magnitude"].resample("D").max()
+# reuse the precomputed aggregate unless the magnitude filter removed rows
+if len(df_filtered) == len(df):
+    mag_over_time = daily_max
+else:
+    mag_over_time = df_filtered.groupby(df_filtered.index.normalize())["magnitude"].max()
+# keep days without events as gaps, as resample("D") did
+mag_over_time = mag_over_time.reindex(pd.date_range(date_range[0], date_range[1], freq="D"))
 st.area_chart(mag_over_time)
 
 # create a bar chart of earthquake magnitudes
 st.subheader("Magnitude Distribution (count)")
-mag_counts = df_filtered["magnitude"].value_counts()
+# count magnitudes in 0.1 buckets, the resolution the API reports them in
+bins = (df_filtered["magnitude"].to_numpy() * 10).round().astype(np.int32)
+counts = np.bincount(bins)
+mag_counts = pd.Series(counts[counts > 0], index=np.flatnonzero(counts) / 10.0)
 st.bar_chart(mag_counts)
 
 # plot the average time difference over time chart
@@ -129,14 +286,16 @@ st.line_chart(time_diff_avg)
 # show the 10 strongest earthquakes
 st.header("10 Strongest Earthquakes")
 with st.expander('10 Strongest Earthquakes Table', expanded=False):
-    st.table(df_filtered.sort_values("magnitude", ascending=False).head(10))
+    st.table(df_filtered.nlargest(10, "magnitude"))
 
 # download button
-def convert_df(df_filtered):
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df_filtered.to_csv().encode('utf-8')
+# cache the conversion to prevent computation on every rerun; the frame itself
+# is not hashed, it is identified by the selection key
+@st.cache_data(max_entries=MAX_CACHE_ENTRIES)
+def convert_df(_df_filtered, selection_key):
+    return _df_filtered.to_csv().encode('utf-8')
 
-csv = convert_df(df_filtered)
+csv = convert_df(df_filtered, selection_key)
 st.sidebar.text(" ")
 st.sidebar.download_button(
     label="Download data as CSV",